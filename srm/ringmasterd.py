@@ -302,7 +302,7 @@ class RingMasterServer(object):
             fd, tmppath = mkstemp(dir=self.swiftdir, suffix='.tmp.ring.gz')
             builder.get_ring().save(tmppath)
             close(fd)
-            if not is_valid_ring(tmppath):
+            if not is_valid_ring(tmppath, deep=True):
                 unlink(tmppath)
                 raise Exception('Ring Validate Failed')
             backup, backup_md5 = make_backup(ring_file, self.backup_dir)
@@ -5,7 +5,7 @@ from os.path import exists, join as pathjoin
 from eventlet import wsgi, listen
 from swift.common.exceptions import LockTimeout
 from swift.common.utils import split_path, readconf, lock_parent_directory
-from srm.utils import Daemon, get_md5sum, get_file_logger
+from srm.utils import Daemon, get_md5sum, get_md5sums, get_file_logger
 
 
 class FileIterable(object):
@@ -63,9 +63,10 @@ class RingMasterApp(object):
             target_file = pathjoin(self.swiftdir, rfile)
             if exists(target_file):
                 self.last_tstamp[target_file] = stat(target_file).st_mtime
-                self.current_md5[target_file] = get_md5sum(target_file)
             else:
                 self.last_tstamp[target_file] = None
+        self.current_md5.update(get_md5sums(
+            [f for f in self.last_tstamp if self.last_tstamp[f] is not None]))
         self.request_logger = FileLikeLogger(self.logger)
 
     def _changed(self, filename):
@@ -10,7 +10,7 @@ from random import choice
 from tempfile import mkstemp
 from os.path import basename, dirname, join as pathjoin, exists
 from swift.common.utils import get_logger, readconf, TRUE_VALUES
-from srm.utils import Daemon, get_md5sum, md5matches, is_valid_ring
+from srm.utils import Daemon, get_md5sums, md5matches, is_valid_ring
 
 
 class RingMinion(object):
@@ -39,11 +39,9 @@ class RingMinion(object):
             self.logger.error('swift_dir is not writable. exiting!')
             sys.exit(1)
         for ring in self.rings:
-            if exists(self.rings[ring]):
-                self.current_md5[self.rings[ring]] = \
-                    get_md5sum(self.rings[ring])
-            else:
-                self.current_md5[self.rings[ring]] = ''
+            self.current_md5[self.rings[ring]] = ''
+        self.current_md5.update(get_md5sums(
+            [r for r in self.rings.values() if exists(r)]))
 
     def _write_ring(self, response, ring_type):
         """Write the ring out to a tmp file
@@ -1,29 +1,37 @@
 """
 Random utils
 """
-from hashlib import md5
+import hashlib
 from os import mkdir
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from swift.common.utils import drop_privileges
-from swift.common.ring import Ring
+from swift.common.ring import Ring, RingData
 from os.path import basename, join as pathjoin
-from shutil import copy
-from errno import EEXIST
+from shutil import copymode
+from errno import EEXIST, ESRCH
 import sys
 import os
+import select
 import atexit
+import queue
 import smtplib
+from email.message import EmailMessage
 import eventlet 
-from signal import SIGTERM
+from eventlet.semaphore import Semaphore
+from signal import SIGTERM, SIGKILL
 from time import time, sleep
-# logging doesn't import patched as cleanly as one would like
-from logging.handlers import SysLogHandler, TimedRotatingFileHandler
+from logging.handlers import SysLogHandler, TimedRotatingFileHandler, \
+    QueueHandler, QueueListener
 import logging
-logging.thread = eventlet.green.thread
-logging.threading = eventlet.green.threading
-logging._lock = logging.threading.RLock()
 # setup notice level logging
 NOTICE = 25
 logging._levelToName[NOTICE] = 'NOTICE'
+_FORMATTER = logging.Formatter('%(asctime)s - %(name)s: %(message)s')
+# md5 is only used for change detection, so skip the FIPS wrappers and let
+# OpenSSL pick its fastest backend (>= 3.2 ships an AVX-512 md5).
+_MD5_NEW = partial(hashlib.new, 'md5', usedforsecurity=False)
+_eventlet_logging_installed = False
 
 
 class EmailNotify(object):
@@ -34,69 +42,192 @@ class EmailNotify(object):
         self.logger = logger
         self.smtp_host = conf.get('smtplib_host', 'localhost')
         self.smtp_port = int(conf.get('smtplib_port', '25'))
+        self.smtp_timeout = float(conf.get('smtplib_timeout', '30'))
         self.from_addr = conf.get('smtplib_from_addr', 'ringmaster@localhost')
-        self.recipients = [x.strip() for x in conf.get(
-            'smtplib_recipients').split(',')]
+        raw = conf.get('smtplib_recipients') or ''
+        self.recipients = [x for x in (r.strip() for r in raw.split(','))
+                           if x]
         if not self.recipients:
-            raise Exception('No smtplib recipients in conf.')
+            raise ValueError('No smtplib recipients in conf.')
+        self._recipients_joined = ', '.join(self.recipients)
+        self._smtp = None
+        self._smtp_lock = Semaphore(1)
+
+    def _close(self):
+        """Drop the cached smtp connection"""
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _get_connection(self):
+        """Return the cached smtp connection, (re)connecting if it's stale"""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close()
+        conn = smtplib.SMTP(self.smtp_host, self.smtp_port,
+                            timeout=self.smtp_timeout)
+        conn.ehlo()
+        self._smtp = conn
+        return conn
 
     def send_message(self, subject, body):
         """Send email with the provided subject and body"""
-        message = """From: %s
-        To: %s
-        Subject: %s
-
-        %s
-        """ % (self.from_addr, self.recipients, subject, body)
         try:
-            conn = smtplib.SMTP(self.smtp_host, self.smtp_port)
-            conn.ehlo()
-            conn.sendmail(self.from_addr, self.recipients, message)
-            conn.close()
-            return True
+            message = EmailMessage()
+            message['From'] = self.from_addr
+            message['To'] = self._recipients_joined
+            message['Subject'] = subject
+            message.set_content(body)
         except Exception:
+            # e.g. CR/LF in a header value or a non-str body
             self.logger.exception('Email notification error.')
             return False
+        with self._smtp_lock:
+            try:
+                try:
+                    self._get_connection().send_message(message)
+                except smtplib.SMTPServerDisconnected:
+                    # server dropped us after the noop, retry once
+                    self._close()
+                    self._get_connection().send_message(message)
+                return True
+            except Exception:
+                self._close()
+                self.logger.exception('Email notification error.')
+                return False
+
+
+def _install_eventlet_logging():
+    """Give logging green locks if threads have been monkey patched
+
+    logging doesn't import patched as cleanly as one would like, so swap in
+    the green modules by hand the first time we set up a logger.
+    """
+    global _eventlet_logging_installed
+    if _eventlet_logging_installed:
+        return
+    _eventlet_logging_installed = True
+    if not eventlet.patcher.is_monkey_patched('thread'):
+        return
+    from eventlet.green import thread as green_thread
+    from eventlet.green import threading as green_threading
+    logging.thread = green_thread
+    logging.threading = green_threading
+    logging._lock = green_threading.RLock()
 
 
 def get_file_logger(name, log_path, level=logging.INFO, count=7, fmt=None):
+    """Get a logger that writes to a daily rotated log file
+
+    Records are handed to a QueueListener thread which does the actual
+    file writes and rotation, keeping them off the caller's path.
+    """
+    _install_eventlet_logging()
     logger = logging.getLogger(name)
+    if logger.handlers:
+        # already set up, don't stack another handler on it
+        return logger
     handler = TimedRotatingFileHandler(log_path, when='midnight',
                                        backupCount=count)
-    formatter = logging.Formatter('%(asctime)s - %(name)s: %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter(fmt) if fmt else _FORMATTER)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    # stop() drains whatever is still queued before we exit
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(level)
     return logger
 
 
-def get_md5sum(filename, chunk_size=4096):
+def get_md5sum(filename, chunk_size=1 << 20):
     """Get the md5sum of a file
 
     :param filename: file to obtain the md5sum of
-    :param chunk_size: chunk size
+    :param chunk_size: chunk size used when hashlib.file_digest is unavailable
     :returns: hex digest of file
     """
-    md5sum = md5()
-    with open(filename, 'rb') as tfile:
-        block = tfile.read(chunk_size)
-        while block:
-            md5sum.update(block)
+    with open(filename, 'rb', buffering=0) as tfile:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(tfile, _MD5_NEW).hexdigest()
+        md5sum = _MD5_NEW()
+        while True:
             block = tfile.read(chunk_size)
+            if not block:
+                break
+            md5sum.update(block)
     return md5sum.hexdigest()
 
 
-def md5matches(target_file, expected_md5):
+def get_md5sums(filenames):
+    """Get the md5sums of several files
+
+    hashlib releases the GIL while digesting large buffers, so the files
+    are hashed concurrently instead of one after another.
+
+    :param filenames: files to obtain the md5sums of
+    :returns: dict mapping each filename to its hex digest
+    """
+    filenames = list(filenames)
+    if len(filenames) < 2:
+        return dict((f, get_md5sum(f)) for f in filenames)
+    with ThreadPoolExecutor(max_workers=len(filenames)) as pool:
+        return dict(zip(filenames, pool.map(get_md5sum, filenames)))
+
+
+def md5matches(target_file, expected_md5, expected_size=None):
     """Check if a file matches an md5sum
 
     :param target_file: file to check
     :param expected_md5: md5 to compare again
+    :param expected_size: optional size in bytes, checked before hashing
     :returns: True or False if md5 matches
     """
-    if get_md5sum(target_file) == expected_md5:
-        return True
-    else:
+    if expected_size is not None and \
+            os.path.getsize(target_file) != expected_size:
         return False
+    return get_md5sum(target_file) == expected_md5
+
+
+def _copy_and_md5(src, dst, bufsize=1 << 20):
+    """Copy src to dst, hashing the data as it goes by
+
+    Reads the source exactly once through a single reused buffer, so there
+    is no second pass over the copy just to get its md5sum.
+
+    :param src: file to copy
+    :param dst: destination path
+    :param bufsize: size of the copy buffer
+    :returns: hex digest of the copied data
+    """
+    md5sum = _MD5_NEW()
+    buf = memoryview(bytearray(bufsize))
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        if size:
+            try:
+                os.posix_fallocate(fdst.fileno(), 0, size)
+            except OSError:
+                pass
+        copied = 0
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                break
+            fdst.write(buf[:n])
+            md5sum.update(buf[:n])
+            copied += n
+        if copied < size:
+            # source shrank while copying, drop the preallocated tail
+            fdst.truncate(copied)
+    return md5sum.hexdigest()
 
 
 def make_backup(filename, backup_dir):
@@ -111,22 +242,37 @@ def make_backup(filename, backup_dir):
         if err.errno != EEXIST:
             raise
     backup = pathjoin(backup_dir, '%d.' % time() + basename(filename))
-    copy(filename, backup)
-    return [backup, get_md5sum(backup)]
+    backup_md5 = _copy_and_md5(filename, backup)
+    copymode(filename, backup)
+    return [backup, backup_md5]
+
+
+def _ring_header_ok(ring_file):
+    """Check a ring's metadata without loading its partition table
+
+    :returns: True if the ring metadata loads and lists at least one device
+    """
+    ring_data = RingData.load(ring_file, metadata_only=True)
+    return any(ring_data.devs)
 
 
-def is_valid_ring(ring_file):
+def is_valid_ring(ring_file, deep=False):
     """Check if a ring file is 'valid'
         - make sure it has more than one device
-        - make sure get_part_nodes works
+        - make sure get_part_nodes works (deep only)
+    :param ring_file: ring file to check
+    :param deep: load the full ring rather than just its metadata
     :returns: True or False if ring is valid
     """
     try:
-        ring = Ring(ring_file)
-        if len(ring.devs) < 1:
-            return False
-        if not ring.get_part_nodes(1):
+        if not _ring_header_ok(ring_file):
             return False
+        if deep:
+            ring = Ring(ring_file)
+            if len(ring.devs) < 1:
+                return False
+            if not ring.get_part_nodes(1):
+                return False
     except Exception:
         return False
     return True
@@ -142,6 +288,9 @@ class Daemon:
     Usage: subclass the Daemon class and override the run() method
     """
 
+    #: seconds to wait for the daemon to exit after SIGTERM (and SIGKILL)
+    stop_timeout = 30
+
     def __init__(self, pidfile, stdin='/dev/null', stdout='/dev/null',
                  stderr='/dev/null', user=None, group=None):
         self.stdin = stdin
@@ -186,16 +335,17 @@ class Daemon:
         # redirect standard file descriptors
         sys.stdout.flush()
         sys.stderr.flush()
-        stin = file(self.stdin, 'r')
-        stout = file(self.stdout, 'a+')
-        sterr = file(self.stderr, 'a+', 0)
-        os.dup2(stin.fileno(), sys.stdin.fileno())
-        os.dup2(stout.fileno(), sys.stdout.fileno())
-        os.dup2(sterr.fileno(), sys.stderr.fileno())
+        with open(self.stdin, 'rb') as stin:
+            os.dup2(stin.fileno(), sys.stdin.fileno())
+        with open(self.stdout, 'ab') as stout:
+            os.dup2(stout.fileno(), sys.stdout.fileno())
+        with open(self.stderr, 'ab') as sterr:
+            os.dup2(sterr.fileno(), sys.stderr.fileno())
         # write pidfile
         atexit.register(self.delpid)
         pid = str(os.getpid())
-        file(self.pidfile, 'w+').write("%s\n" % pid)
+        with open(self.pidfile, 'w+') as pidfile:
+            pidfile.write("%s\n" % pid)
         drop_privileges(user=self.uid)
 
     def delpid(self):
@@ -208,9 +358,8 @@ class Daemon:
         """
         # Check for a pidfile to see if the daemon already runs
         try:
-            pidfile = file(self.pidfile, 'r')
-            pid = int(pidfile.read().strip())
-            pidfile.close()
+            with open(self.pidfile, 'r') as pidfile:
+                pid = int(pidfile.read().strip())
         except IOError:
             pid = None
 
@@ -235,9 +384,8 @@ class Daemon:
         """
         # Get the pid from the pidfile
         try:
-            pidfile = file(self.pidfile, 'r')
-            pid = int(pidfile.read().strip())
-            pidfile.close()
+            with open(self.pidfile, 'r') as pidfile:
+                pid = int(pidfile.read().strip())
         except IOError:
             pid = None
 
@@ -247,17 +395,56 @@ class Daemon:
             return  # not an error in a restart
 
         try:
-            while 1:
-                os.kill(pid, SIGTERM)
-                sleep(0.1)
+            os.kill(pid, SIGTERM)
+            if not self._wait_for_exit(pid, self.stop_timeout):
+                os.kill(pid, SIGKILL)
+                if not self._wait_for_exit(pid, self.stop_timeout):
+                    print("pid %d did not exit after SIGKILL" % pid)
+                    sys.exit(1)
         except OSError as err:
-            err = str(err)
-            if err.find("No such process") > 0:
-                if os.path.exists(self.pidfile):
-                    os.remove(self.pidfile)
-            else:
+            if err.errno != ESRCH:
                 print(str(err))
                 sys.exit(1)
+        if os.path.exists(self.pidfile):
+            os.remove(self.pidfile)
+
+    @staticmethod
+    def _wait_for_exit(pid, timeout):
+        """Wait for a process to exit
+
+        Blocks on a pidfd where the kernel supports it, otherwise probes the
+        pid with signal 0 using an exponential backoff.
+
+        :param pid: pid to wait on
+        :param timeout: max seconds to wait
+        :returns: True if the process exited, False if we timed out
+        """
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError as err:
+                if err.errno == ESRCH:
+                    return True
+                pidfd = None
+            if pidfd is not None:
+                try:
+                    return bool(select.select([pidfd], [], [], timeout)[0])
+                finally:
+                    os.close(pidfd)
+        deadline = time() + timeout
+        delay = 0.01
+        while True:
+            try:
+                os.kill(pid, 0)
+            except OSError as err:
+                if err.errno == ESRCH:
+                    return True
+                raise
+            remaining = deadline - time()
+            if remaining <= 0:
+                return False
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
 
     def restart(self, *args, **kw):
         """Restart the daemon"""
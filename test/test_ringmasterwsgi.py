@@ -23,8 +23,9 @@ class FakedBuilder(object):
     def __init__(self, device_count=5):
         self.device_count = device_count
 
-    def gen_builder(self, balanced=False):
+    def gen_builder(self, balanced=False, start_id=0):
         builder = RingBuilder(18, 3, 1)
+        next_dev_id = start_id
         for i in range(self.device_count):
             region = '1'
             zone = i
@@ -33,12 +34,10 @@ class FakedBuilder(object):
             device_name = "sd%s" % i
             weight = 100.0
             meta = "meta for %s" % i
-            next_dev_id = 0
-            if builder.devs:
-                next_dev_id = max(d['id'] for d in builder.devs if d) + 1
             builder.add_dev({'id': next_dev_id, 'zone': zone, 'ip': ipaddr,
                              'port': int(port), 'device': device_name,
                              'weight': weight, 'meta': meta, 'region': region})
+            next_dev_id += 1
             if balanced:
                 builder.rebalance()
         return builder
@@ -1,7 +1,7 @@
 import os
 import unittest
 import pickle as pickle
-from shutil import rmtree
+from shutil import rmtree, copy2
 from tempfile import mkdtemp
 from mock import MagicMock, patch
 from swift.common.ring import RingBuilder
@@ -35,8 +35,9 @@ class FakedBuilder(object):
     def __init__(self, device_count=4):
         self.device_count = device_count
 
-    def gen_builder(self, balanced=False):
+    def gen_builder(self, balanced=False, start_id=0):
         builder = RingBuilder(8, 3, 1)
+        next_dev_id = start_id
         for i in range(self.device_count):
             region = "1"
             zone = i
@@ -45,12 +46,10 @@ class FakedBuilder(object):
             device_name = "sd%s" % i
             weight = 100.0
             meta = "meta for %s" % i
-            next_dev_id = 0
-            if builder.devs:
-                next_dev_id = max(d['id'] for d in builder.devs if d) + 1
             builder.add_dev({'id': next_dev_id, 'zone': zone, 'ip': ipaddr,
                              'port': int(port), 'device': device_name,
                              'weight': weight, 'meta': meta, 'region': region})
+            next_dev_id += 1
         if balanced:
             builder.rebalance()
         return builder
@@ -61,6 +60,16 @@ class FakedBuilder(object):
 
 class test_ringmasterminion(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # build and rebalance the default ring once, tests copy it
+        cls._master_testdir = mkdtemp()
+        cls._build_obj_ring(cls._master_testdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        rmtree(cls._master_testdir, ignore_errors=True)
+
     def setUp(self):
         utils.HASH_PATH_SUFFIX = 'endcap'
         utils.HASH_PATH_PREFIX = ''
@@ -75,12 +84,20 @@ class test_ringmasterminion(unittest.TestCase):
         except Exception:
             pass
 
-    def _setup_obj_ring(self, count=4, balanced=True):
+    @staticmethod
+    def _build_obj_ring(testdir, count=4, balanced=True):
         fb = FakedBuilder(device_count=count)
         builder = fb.gen_builder(balanced=balanced)
-        fb.write_builder(os.path.join(self.testdir, 'object.builder'), builder)
+        fb.write_builder(os.path.join(testdir, 'object.builder'), builder)
         ring_file = 'object.ring.gz'
-        builder.get_ring().save(os.path.join(self.testdir, ring_file))
+        builder.get_ring().save(os.path.join(testdir, ring_file))
+
+    def _setup_obj_ring(self, count=4, balanced=True):
+        if (count, balanced) != (4, True):
+            self._build_obj_ring(self.testdir, count, balanced)
+            return
+        for i in ['object.builder', 'object.ring.gz']:
+            copy2(os.path.join(self._master_testdir, i), self.testdir)
 
     def test_validate_ring(self):
         self._setup_obj_ring()
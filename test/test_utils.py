@@ -0,0 +1,231 @@
+import os
+import hashlib
+import gzip
+import struct
+import errno
+import signal
+import subprocess
+import threading
+import time
+import logging
+import smtplib
+import unittest
+from hashlib import md5
+from shutil import rmtree
+from tempfile import mkdtemp
+from mock import patch, MagicMock
+from swift.common.ring import RingBuilder
+from srm import utils
+
+
+class test_utils(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+
+    def tearDown(self):
+        try:
+            rmtree(self.testdir)
+        except Exception:
+            pass
+
+    def _write(self, name, data):
+        tfile = os.path.join(self.testdir, name)
+        with open(tfile, 'wb') as f:
+            f.write(data)
+        return tfile
+
+    def test_get_md5sum(self):
+        data = b'ring' * 300000
+        tfile = self._write('test.ring.gz', data)
+        self.assertEqual(utils.get_md5sum(tfile), md5(data).hexdigest())
+        self.assertEqual(utils.get_md5sum(self._write('empty', b'')),
+                         md5(b'').hexdigest())
+
+    @unittest.skipUnless(hasattr(hashlib, 'file_digest'), 'python < 3.11')
+    def test_get_md5sum_file_digest(self):
+        data = b'ring' * 300000
+        tfile = self._write('test.ring.gz', data)
+        file_digest = hashlib.file_digest
+        with patch('srm.utils.hashlib.file_digest',
+                   side_effect=file_digest) as fdigest:
+            self.assertEqual(utils.get_md5sum(tfile), md5(data).hexdigest())
+            self.assertEqual(fdigest.call_count, 1)
+        # without file_digest (python < 3.11) the file is read in chunks
+        del hashlib.file_digest
+        try:
+            self.assertEqual(utils.get_md5sum(tfile, chunk_size=4096),
+                             md5(data).hexdigest())
+        finally:
+            hashlib.file_digest = file_digest
+
+    def test_md5matches(self):
+        tfile = self._write('test.ring.gz', b'ring')
+        self.assertTrue(utils.md5matches(tfile, md5(b'ring').hexdigest()))
+        self.assertFalse(utils.md5matches(tfile, 'badmd5'))
+        self.assertTrue(utils.md5matches(tfile, md5(b'ring').hexdigest(),
+                                         expected_size=4))
+        with patch('srm.utils.get_md5sum') as fmd5:
+            self.assertFalse(utils.md5matches(
+                tfile, md5(b'ring').hexdigest(), expected_size=5))
+            self.assertFalse(fmd5.called)
+
+    def test_get_md5sums(self):
+        files = [self._write('f%d' % i, b'data%d' % i) for i in range(3)]
+        result = utils.get_md5sums(files)
+        self.assertEqual(result, dict((f, utils.get_md5sum(f))
+                                      for f in files))
+        self.assertEqual(utils.get_md5sums([]), {})
+
+    def test_make_backup(self):
+        tfile = self._write('object.builder', b'builder')
+        backup_dir = os.path.join(self.testdir, 'backup')
+        backup, backup_md5 = utils.make_backup(tfile, backup_dir)
+        self.assertTrue(backup.startswith(backup_dir))
+        self.assertTrue(backup.endswith('.object.builder'))
+        self.assertEqual(backup_md5, md5(b'builder').hexdigest())
+        with open(backup, 'rb') as f:
+            self.assertEqual(f.read(), b'builder')
+
+    def test_copy_and_md5(self):
+        data = b'builder' * 100000
+        tfile = self._write('object.builder', data)
+        dst = os.path.join(self.testdir, 'copy')
+        self.assertEqual(utils._copy_and_md5(tfile, dst, bufsize=4096),
+                         md5(data).hexdigest())
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        empty = self._write('empty', b'')
+        self.assertEqual(utils._copy_and_md5(empty, dst),
+                         md5(b'').hexdigest())
+        self.assertEqual(os.path.getsize(dst), 0)
+
+    def test_get_file_logger(self):
+        log_path = os.path.join(self.testdir, 'test.log')
+        logger = utils.get_file_logger('srm-test-file-logger', log_path)
+        logger.info('hello from the queue')
+        for _junk in range(100):
+            with open(log_path) as f:
+                if 'hello from the queue' in f.read():
+                    break
+            time.sleep(0.01)
+        else:
+            self.fail('Log record never reached the log file')
+
+    def test_get_file_logger_only_once(self):
+        log_path = os.path.join(self.testdir, 'test.log')
+        logger = utils.get_file_logger('srm-test-once', log_path,
+                                       level=logging.DEBUG)
+        self.assertEqual(logger.level, logging.DEBUG)
+        self.assertEqual(len(logger.handlers), 1)
+        again = utils.get_file_logger('srm-test-once', log_path)
+        self.assertTrue(again is logger)
+        self.assertEqual(len(logger.handlers), 1)
+
+    def test_email_notify_recipients(self):
+        notify = utils.EmailNotify(
+            {'smtplib_recipients': ' a@b.c,, d@e.f ,'}, MagicMock())
+        self.assertEqual(notify.recipients, ['a@b.c', 'd@e.f'])
+        for conf in ({}, {'smtplib_recipients': ''},
+                     {'smtplib_recipients': ' , '}):
+            self.assertRaises(ValueError, utils.EmailNotify, conf,
+                              MagicMock())
+
+    @patch('srm.utils.smtplib.SMTP')
+    def test_email_notify_reuses_connection(self, fsmtp):
+        conn = fsmtp.return_value
+        conn.noop.return_value = (250, b'OK')
+        notify = utils.EmailNotify({'smtplib_recipients': 'a@b.c, d@e.f'},
+                                   MagicMock())
+        self.assertTrue(notify.send_message('subject', 'body'))
+        fsmtp.assert_called_once_with('localhost', 25, timeout=30.0)
+        message = conn.send_message.call_args[0][0]
+        self.assertEqual(message['From'], 'ringmaster@localhost')
+        self.assertEqual(message['To'], 'a@b.c, d@e.f')
+        self.assertEqual(message['Subject'], 'subject')
+        self.assertEqual(message.get_content(), 'body\n')
+        self.assertTrue(notify.send_message('subject', 'body'))
+        self.assertEqual(fsmtp.call_count, 1)
+        self.assertEqual(conn.send_message.call_count, 2)
+        self.assertFalse(conn.close.called)
+        # stale connection gets replaced
+        conn.noop.side_effect = smtplib.SMTPServerDisconnected()
+        self.assertTrue(notify.send_message('subject', 'body'))
+        self.assertEqual(fsmtp.call_count, 2)
+        conn.noop.side_effect = None
+        # disconnect during send is retried once on a new connection
+        conn.send_message.side_effect = [smtplib.SMTPServerDisconnected(), {}]
+        self.assertTrue(notify.send_message('subject', 'body'))
+        self.assertEqual(fsmtp.call_count, 3)
+        conn.send_message.side_effect = Exception('boom')
+        self.assertFalse(notify.send_message('subject', 'body'))
+        self.assertTrue(notify.logger.exception.called)
+        self.assertEqual(notify._smtp, None)
+        # a message we can't build is reported, not raised
+        notify.logger.reset_mock()
+        conn.send_message.reset_mock()
+        self.assertFalse(notify.send_message('bad\r\nsubject', 'body'))
+        self.assertFalse(notify.send_message('subject', b'body'))
+        self.assertEqual(notify.logger.exception.call_count, 2)
+        self.assertFalse(conn.send_message.called)
+
+    def _reaped_child(self):
+        proc = subprocess.Popen(['sleep', '60'])
+        reaper = threading.Thread(target=proc.wait)
+        reaper.start()
+        self.addCleanup(reaper.join)
+        self.addCleanup(proc.kill)
+        return proc
+
+    def test_daemon_wait_for_exit(self):
+        proc = self._reaped_child()
+        self.assertFalse(utils.Daemon._wait_for_exit(proc.pid, 0.05))
+        os.kill(proc.pid, signal.SIGTERM)
+        self.assertTrue(utils.Daemon._wait_for_exit(proc.pid, 5))
+
+    def test_daemon_wait_for_exit_without_pidfd(self):
+        proc = self._reaped_child()
+        with patch('srm.utils.os.pidfd_open', side_effect=OSError(
+                errno.ENOSYS, 'nope'), create=True):
+            self.assertFalse(utils.Daemon._wait_for_exit(proc.pid, 0.05))
+            os.kill(proc.pid, signal.SIGTERM)
+            self.assertTrue(utils.Daemon._wait_for_exit(proc.pid, 5))
+
+    def test_daemon_stop(self):
+        proc = self._reaped_child()
+        pidfile = self._write('test.pid', b'%d\n' % proc.pid)
+        utils.Daemon(pidfile).stop()
+        self.assertFalse(os.path.exists(pidfile))
+        self.assertEqual(proc.wait(), -signal.SIGTERM)
+
+    def _write_ring(self, name):
+        builder = RingBuilder(8, 3, 1)
+        for i in range(4):
+            builder.add_dev({'id': i, 'zone': i, 'ip': '1.1.1.1',
+                             'port': 6010, 'device': 'sd%s' % i,
+                             'weight': 100.0, 'meta': '', 'region': 1})
+        builder.rebalance()
+        ring_file = os.path.join(self.testdir, name)
+        builder.get_ring().save(ring_file)
+        return ring_file
+
+    def test_is_valid_ring(self):
+        ring_file = self._write_ring('object.ring.gz')
+        self.assertTrue(utils.is_valid_ring(ring_file))
+        self.assertTrue(utils.is_valid_ring(ring_file, deep=True))
+        # keep the header but drop the partition table
+        with gzip.open(ring_file, 'rb') as f:
+            header = f.read(10)
+            header += f.read(struct.unpack('!I', header[6:])[0])
+        truncated = os.path.join(self.testdir, 'truncated.ring.gz')
+        with gzip.open(truncated, 'wb') as f:
+            f.write(header)
+        self.assertTrue(utils.is_valid_ring(truncated))
+        self.assertFalse(utils.is_valid_ring(truncated, deep=True))
+        junk = self._write('junk.ring.gz', b'whatisthis.')
+        self.assertFalse(utils.is_valid_ring(junk))
+        self.assertFalse(utils.is_valid_ring(junk, deep=True))
+
+
+if __name__ == '__main__':
+    unittest.main()